@@ -5,174 +5,268 @@
 并在SVG文件的右上方添加图例
 """
 
-import xml.etree.ElementTree as ET
+try:
+    # 优先使用lxml（libxml2的C解析器，解析大文件快好几倍）
+    # 下面只用两个后端都支持的ElementTree兼容API
+    from lxml import etree as ET
+    _USING_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    _USING_LXML = False
 import sys
 import argparse
+import bisect
+import functools
+import gzip
+import hashlib
 import os
 import re
 import logging
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import xml.sax
+from xml.sax import saxutils
+
+# XML解析错误类型：树后端（stdlib: ParseError, lxml: XMLSyntaxError）
+# 加上GEXF走SAX解析时抛出的SAXParseException
+_XML_PARSE_ERROR = (getattr(ET, 'ParseError', None) or ET.XMLSyntaxError,
+                    xml.sax.SAXParseException)
+
+# 命名空间与限定名常量
+# 调用点每次重新拼f'{{ns}}tag'都会产生一次字符串分配，统一提升到模块级
+GEXF_NS = 'http://gexf.net/1.3'
+VIZ_NS = 'http://gexf.net/1.3/viz'
+SVG_NS = 'http://www.w3.org/2000/svg'
+SVG_CIRCLE_TAG = f'{{{SVG_NS}}}circle'
+SVG_TEXT_TAG = f'{{{SVG_NS}}}text'
+SVG_TSPAN_TAG = f'{{{SVG_NS}}}tspan'
+SVG_USE_TAG = f'{{{SVG_NS}}}use'
+SVG_NODES_GROUP_PATH = f'.//{{{SVG_NS}}}g[@id="nodes"]'
+SVG_LABELS_GROUP_PATH = f'.//{{{SVG_NS}}}g[@id="node-labels"]'
+
+# stdlib序列化SVG时不要带ns0:前缀，注册一次默认命名空间即可
+# lxml不接受空前缀的注册（抛ValueError），但它本来就保留解析时的默认nsmap，
+# 图例模板又自带xmlns声明，所以lxml后端不需要也不能做这次注册
+if not _USING_LXML:
+    ET.register_namespace('', SVG_NS)
+
+# 图例是固定形状的模板，直接拼字符串再一次性fromstring，
+# 比逐个SubElement构建省掉每元素的对象和属性字典分配
+# 逐项重复的stroke/字体属性上提到两个分组<g>上由子元素继承，
+# 每行只剩坐标和颜色，图例字节数和渲染器要解析的属性都更少
+LEGEND_GROUP_TMPL = (
+    '<g xmlns="http://www.w3.org/2000/svg" id="legend" class="legend">'
+    '<rect x="{bg_x:g}" y="{bg_y:g}" width="{bg_w}" height="{bg_h}"'
+    ' fill="white" fill-opacity="0.9" stroke="black" stroke-width="2"/>'
+    '<text x="{title_x:g}" y="{title_y:g}" font-size="{title_fs}" font-weight="bold"'
+    ' fill="#000000" font-family="Times New Roman, serif">Layer</text>'
+    '<g stroke="#000000" stroke-width="1">{boxes}</g>'
+    '<g font-size="{label_fs}" fill="#000000"'
+    ' font-family="Times New Roman, serif">{labels}</g>'
+    '</g>'
+)
+
+# 同色的颜色方块合并成一个<path>（M/h/v/z子路径逐个画方块），
+# 元素数从每行一个降到每种颜色一个
+LEGEND_BOX_TMPL = '<path d="{d}" fill="{color}"/>'
+
+LEGEND_LABEL_TMPL = '<text x="{label_x:g}" y="{label_y:g}">{label}</text>'
+
+def _fmt(v):
+    """坐标格式化为两位小数（字号类整数值用:g，避免无谓的.00）"""
+    return f'{v:.2f}'
+
+class _GexfLayerColorHandler(xml.sax.handler.ContentHandler):
+    """SAX回调里直接提取每个节点的(layer, color)，全程不建任何Element"""
+
+    def __init__(self):
+        super().__init__()
+        # 收集layer到颜色集合的桶，冲突检查挪到解析结束后做一次
+        # 用dict当有序集合，保证"第一个出现的颜色胜出"的行为不变
+        self.buckets = defaultdict(dict)
+        self.node_count = 0
+        self._in_node = False
+        self._layer = None
+        self._color = None
+
+    def startElementNS(self, name, qname, attrs):
+        ns, local = name
+        if ns == GEXF_NS:
+            if local == 'node':
+                self._in_node = True
+                self._layer = None
+                self._color = None
+                self.node_count += 1
+            # attvalue可能包在<attvalues>下，也可能直接挂在node下，
+            # 按"进入node之后"统一处理，不区分嵌套层级
+            elif local == 'attvalue' and self._in_node and self._layer is None:
+                if attrs.get((None, 'for')) == 'layer':
+                    self._layer = attrs.get((None, 'value'))
+        elif ns == VIZ_NS and local == 'color' and self._in_node and self._color is None:
+            self._color = (f"rgb({attrs.get((None, 'r'), '0')}, "
+                           f"{attrs.get((None, 'g'), '0')}, "
+                           f"{attrs.get((None, 'b'), '0')})")
+
+    def endElementNS(self, name, qname):
+        if self._in_node and name == (GEXF_NS, 'node'):
+            self._in_node = False
+            # layer或color缺失的节点直接跳过；
+            # 热路径里只做一次入桶，不做冲突比较和日志
+            if self._layer and self._color is not None:
+                self.buckets[self._layer][self._color] = None
+
 
 def parse_gexf(gexf_file):
     """
     解析GEXF文件，提取所有节点的layer和color信息
-    
+
     Args:
         gexf_file: GEXF文件路径
-    
+
     Returns:
         dict: layer到color的映射字典
     """
-    # 定义命名空间
-    # 根元素有默认命名空间 http://gexf.net/1.3
-    # viz元素有命名空间 http://gexf.net/1.3/viz
-    gexf_ns = 'http://gexf.net/1.3'
-    viz_ns = 'http://gexf.net/1.3/viz'
-    
-    # 解析XML文件
-    tree = ET.parse(gexf_file)
-    root = tree.getroot()
-    
-    # 存储layer到color的映射
+
+    # SAX解析：expat的C解析器逐事件回调，不分配节点树，
+    # 峰值内存只随不同layer的数量增长，与文件大小无关
+    handler = _GexfLayerColorHandler()
+    parser = xml.sax.make_parser()
+    parser.setFeature(xml.sax.handler.feature_namespaces, True)
+    parser.setContentHandler(handler)
+    # 自己打开文件再喂给SAX：直接传路径会被当成URL解析，
+    # 文件不存在时抛的就不是FileNotFoundError了
+    with open(gexf_file, 'rb') as f:
+        parser.parse(f)
+
+    logging.info("Found %d nodes\n", handler.node_count)
+
+    # 解析结束后对去重过的小集合做冲突检查，每个layer最多警告一次
     layer_color_map = {}
-    
-    # 查找所有节点（节点在gexf命名空间下）
-    nodes = root.findall(f'.//{{{gexf_ns}}}node')
-    
-    logging.info(f"Found {len(nodes)} nodes\n")
-    
-    # 遍历每个节点
-    for node in nodes:
-        # 提取layer值
-        layer = None
-        attvalues = node.findall(f'.//{{{gexf_ns}}}attvalue[@for="layer"]')
-        if attvalues:
-            layer = attvalues[0].get('value')
-        
-        # 提取color值（viz:color在viz命名空间下）
-        color = None
-        color_elem = node.find(f'.//{{{viz_ns}}}color')
-        
-        if color_elem is not None:
-            r = color_elem.get('r', '0')
-            g = color_elem.get('g', '0')
-            b = color_elem.get('b', '0')
-            color = f"rgb({r}, {g}, {b})"
-        
-        # 如果layer和color都存在，添加到映射中
-        if layer and color:
-            # 如果该layer还没有记录，或者记录的颜色相同，则更新
-            if layer not in layer_color_map:
-                layer_color_map[layer] = color
-            elif layer_color_map[layer] != color:
-                # 如果同一个layer有不同的color，打印警告
-                logging.warning(f"Warning: layer '{layer}' has different color values!")
-                logging.warning(f"  Existing color: {layer_color_map[layer]}")
-                logging.warning(f"  New color: {color}\n")
-    
+    for layer, colors in handler.buckets.items():
+        if len(colors) > 1:
+            logging.warning("Warning: layer '%s' has different color values!", layer)
+            logging.warning("  Using: %s", next(iter(colors)))
+            logging.warning("  Ignored: %s\n", ', '.join(list(colors)[1:]))
+        layer_color_map[layer] = next(iter(colors))
+
     return layer_color_map
 
+# Times New Roman常见字符的近似宽度（em单位，即字号的倍数）
+# 窄字符（i、l、标点）和宽字符（m、w、大写）单列，
+# 未列出的字符按0.5em处理；比统一的0.6平均值贴近实际渲染宽度，
+# 估得准意味着换行更少误判、字号求解收敛更快
+_TNR_EM_WIDTHS = {
+    ' ': 0.25, '.': 0.25, ',': 0.25, ';': 0.28, ':': 0.28,
+    "'": 0.18, '!': 0.33, '(': 0.33, ')': 0.33, '-': 0.33,
+    'i': 0.28, 'j': 0.28, 'l': 0.28, 't': 0.28, 'f': 0.33, 'r': 0.33,
+    's': 0.39, 'I': 0.33, 'J': 0.39,
+    'm': 0.78, 'w': 0.72, 'M': 0.89, 'W': 0.94,
+    'A': 0.72, 'B': 0.67, 'C': 0.67, 'D': 0.72, 'E': 0.61, 'F': 0.56,
+    'G': 0.72, 'H': 0.72, 'K': 0.72, 'L': 0.61, 'N': 0.72, 'O': 0.72,
+    'P': 0.56, 'Q': 0.72, 'R': 0.67, 'S': 0.56, 'T': 0.61, 'U': 0.72,
+    'V': 0.72, 'X': 0.72, 'Y': 0.72, 'Z': 0.61,
+}
+
+@functools.lru_cache(maxsize=4096)
+def _text_em_width(text):
+    """文本宽度（em单位），按字符宽度表逐字累加并缓存"""
+    get = _TNR_EM_WIDTHS.get
+    return sum(get(c, 0.5) for c in text)
+
 def estimate_text_width(text, font_size, font_family='Times New Roman'):
     """
     估算文本宽度
-    
+
     Args:
         text: 文本内容
         font_size: 字体大小
         font_family: 字体族
-    
+
     Returns:
         float: 估算的文本宽度
     """
-    # 对于Times New Roman等比例字体，使用0.6作为平均字符宽度系数
-    # 这个系数可以根据实际字体调整
-    char_width_factor = 0.6
-    
-    # 计算文本宽度（字符数 × 字体大小 × 系数）
-    text_width = len(text) * float(font_size) * char_width_factor
-    return text_width
+    # em宽度只取决于文本本身，按文本缓存后乘以字号
+    # 换行和字号求解会以不同字号反复请求相同文本
+    return _text_em_width(text) * float(font_size)
+
+@functools.lru_cache(maxsize=2048)
+def _split_words(text):
+    """分词和每词em宽度只算一次，按文本缓存（字号变化时直接复用）"""
+    words = tuple(text.split())
+    return words, tuple(_text_em_width(w) for w in words)
+
+@functools.lru_cache(maxsize=2048)
+def _wrap_words(text, font_size, node_diameter):
+    """换行计算的缓存核心，返回不可变的行元组以便安全缓存"""
+    # 按单词分割文本（是否需要换行由compute_layout判断）
+    # 字号求解会以不同字号反复换行同一段文本，分词结果跨字号共享
+    words, ems = _split_words(text)
+    if not words:
+        return (text,)
+
+    # 宽度模型是“em宽度 × 字号”，逐词调用宽度估算函数没有必要，
+    # 直接用预先算好的每词em宽度构造前缀和：
+    # prefix[k] = 前k个单词的宽度之和 + k个单词间距
+    # 第i..j-1个单词组成一行的宽度 = prefix[j] - prefix[i] - space_width
+    space_width = _TNR_EM_WIDTHS[' '] * font_size
+    prefix = [0.0]
+    acc = 0.0
+    for em in ems:
+        acc += em * font_size + space_width
+        prefix.append(acc)
+
+    # “估算后跳跃”：对每一行用二分直接定位能容纳的最后一个单词，
+    # 宽度测量次数从每词一次降到每行一次
+    lines = []
+    i = 0
+    n = len(words)
+    while i < n:
+        limit = prefix[i] + space_width + node_diameter
+        j = bisect.bisect_right(prefix, limit) - 1
+        if j <= i:
+            # 单个超长单词独占一行
+            j = i + 1
+        lines.append(' '.join(words[i:j]))
+        i = j
+
+    return tuple(lines)
 
 def wrap_text_to_fit_diameter(text, font_size, node_diameter, font_family='Times New Roman'):
     """
     将文本换行以适应节点直径（仅按单词换行）
-    
+
     Args:
         text: 原始文本
         font_size: 字体大小
         node_diameter: 节点直径
         font_family: 字体族
-    
+
     Returns:
         list: 换行后的文本行列表
     """
-    # 如果文本宽度小于节点直径，不需要换行
-    text_width = estimate_text_width(text, font_size, font_family)
-    if text_width <= node_diameter:
-        return [text]
-    
-    # 需要换行，按单词分割文本
-    words = text.split()
-    if not words:
-        return [text]
-    
-    lines = []
-    current_line = []
-    current_width = 0
-    
-    # 单词间距的宽度（大约为字体大小的0.3倍）
-    space_width = float(font_size) * 0.3
-    
-    for word in words:
-        word_width = estimate_text_width(word, font_size, font_family)
-        
-        # 如果当前行加上这个单词会超过节点直径，开始新行
-        if current_line and current_width + space_width + word_width > node_diameter:
-            lines.append(' '.join(current_line))
-            current_line = [word]
-            current_width = word_width
-        else:
-            if current_line:
-                current_width += space_width
-            current_line.append(word)
-            current_width += word_width
-    
-    # 添加最后一行
-    if current_line:
-        lines.append(' '.join(current_line))
-    
-    return lines
+    # 字号求解时同一(文本, 字号, 直径)会反复换行，结果按参数缓存
+    return list(_wrap_words(text, float(font_size), node_diameter))
 
-def can_fit_with_wrapping(text, font_size, node_diameter, font_family='Times New Roman'):
+def compute_layout(text, font_size, node_diameter, font_family='Times New Roman'):
     """
-    检查通过换行，文本是否能在指定字体大小下适应节点
-    
+    计算文本在节点内的布局（判断是否放得下和换行融合为一次遍历）
+
     Args:
         text: 文本内容
         font_size: 字体大小
         node_diameter: 节点直径
         font_family: 字体族
-    
+
     Returns:
-        tuple: (是否适应, 换行后的行列表)
+        list: 文本行列表（放得下时只有一行）
     """
-    # 尝试换行
-    lines = wrap_text_to_fit_diameter(text, font_size, node_diameter, font_family)
-    
-    # 检查所有行是否都能适应节点宽度
-    available_width = node_diameter * 0.95
-    for line in lines:
-        line_width = estimate_text_width(line, font_size, font_family)
-        if line_width > available_width:
-            return False, lines
-    
-    # 检查总高度是否适应节点高度
-    available_height = node_diameter * 0.95
-    line_height = font_size * 1.2
-    total_height = (len(lines) - 1) * line_height + font_size
-    
-    if total_height > available_height:
-        return False, lines
-    
-    return True, lines
+    font_size = float(font_size)
+
+    # 只测一次整行宽度，放得下就直接返回，不进入换行逻辑
+    if estimate_text_width(text, font_size, font_family) <= node_diameter:
+        return [text]
+
+    return wrap_text_to_fit_diameter(text, font_size, node_diameter, font_family)
 
 def calculate_optimal_font_size(text, node_diameter, font_family='Times New Roman', min_font_size=4, max_font_size=100):
     """
@@ -189,73 +283,143 @@ def calculate_optimal_font_size(text, node_diameter, font_family='Times New Roma
     Returns:
         float: 计算出的最优字体大小
     """
-    # 从最大字体开始，逐步降低，找到能适应的最大字体
-    # 使用二分查找加速这个过程
-    left, right = min_font_size, max_font_size
-    optimal_size = min_font_size
-    
-    while left <= right:
-        mid = (left + right) / 2
-        can_fit, _ = can_fit_with_wrapping(text, mid, node_diameter, font_family)
-        
-        if can_fit:
-            # 当前字体大小可以适应，尝试更大的
-            optimal_size = mid
-            left = mid + 0.5
+    # 比例缩放求解代替0.5步长的二分查找：
+    # 固定换行方式时最宽行宽度和总高度都与字号成正比，
+    # 量一次就知道需要缩小到什么比例；缩小后换行点可能变化，
+    # 重新换行再验证，通常2-3轮收敛
+    available = node_diameter * 0.95
+    size = float(max_font_size)
+    for _ in range(4):
+        lines = compute_layout(text, size, node_diameter, font_family)
+        widest = max(estimate_text_width(line, size, font_family) for line in lines)
+        total_height = ((len(lines) - 1) * 1.2 + 1.0) * size
+        scale = min(available / widest if widest > 0 else 1.0,
+                    available / total_height)
+        if scale >= 1.0:
+            break
+        size *= scale
+        if size <= min_font_size:
+            size = min_font_size
+            break
+    return max(min_font_size, min(max_font_size, size))
+
+def compute_label_layout(job):
+    """
+    计算单个标签的布局（最优字体大小 + 行列表）
+
+    纯函数且参数可pickle，既是串行路径的计算核心，
+    也能直接交给进程池并行执行
+
+    Args:
+        job: (text_content, node_diameter, font_family, font_size,
+              auto_font_size, calc_min_font_size, calc_max_font_size)元组
+
+    Returns:
+        tuple: (最优字体大小, 行列表)
+    """
+    (text_content, node_diameter, font_family, font_size,
+     auto_font_size, calc_min_font_size, calc_max_font_size) = job
+
+    optimal_font_size = font_size
+    if auto_font_size:
+        # 上限字号下单行宽度和高度都放得下时答案就是上限本身，
+        # 一次比较替掉整个求解过程（大图里小标签占大多数）
+        available = node_diameter * 0.95
+        max_fs = float(calc_max_font_size)
+        if estimate_text_width(text_content, max_fs) <= available and max_fs <= available:
+            return max_fs, [text_content]
+
+        # 先用原始字体大小检查是否需要换行
+        lines_initial = compute_layout(text_content, font_size, node_diameter, font_family)
+
+        # 对于多行文本，考虑多行所需的高度空间
+        if len(lines_initial) > 1:
+            # 多行情况：为每一行计算最优字体大小，取最小值
+            optimal_font_size = min(
+                calculate_optimal_font_size(line, node_diameter, font_family,
+                                            calc_min_font_size, calc_max_font_size)
+                for line in lines_initial
+            )
         else:
-            # 当前字体大小不能适应，尝试更小的
-            right = mid - 0.5
-    
-    return max(optimal_size, min_font_size)
+            # 单行情况：直接计算最优字体大小
+            optimal_font_size = calculate_optimal_font_size(
+                text_content, node_diameter, font_family,
+                calc_min_font_size, calc_max_font_size)
+
+    # 检查最终字体大小下是否需要换行
+    lines_to_use = compute_layout(text_content, optimal_font_size, node_diameter, font_family)
+    return optimal_font_size, lines_to_use
 
-def adjust_node_labels_in_tree(tree, root, auto_font_size=False, min_font_size=None, max_font_size=None):
+def adjust_node_labels_in_tree(tree, root, auto_font_size=False, min_font_size=None, max_font_size=None, dedup_labels=False):
     """
     在内存中调整SVG树中节点标签的文本，使其适应节点直径（不保存文件）
-    
+
     Args:
         tree: ElementTree对象
         root: 根元素
         auto_font_size: 是否自动调整字体大小以适应节点
         min_font_size: 最小字体大小（字体底线）
         max_font_size: 最大字体大小（初始目标，会根据最大节点调整）
-    
+        dedup_labels: 是否用<use>引用去重内容完全相同的标签
+
     Returns:
         int: 修改的节点数量
     """
-    svg_ns = 'http://www.w3.org/2000/svg'
-    
     # 查找节点组和标签组
-    nodes_group = root.find(f'.//{{{svg_ns}}}g[@id="nodes"]')
-    labels_group = root.find(f'.//{{{svg_ns}}}g[@id="node-labels"]')
+    nodes_group = root.find(SVG_NODES_GROUP_PATH)
+    labels_group = root.find(SVG_LABELS_GROUP_PATH)
     
     if nodes_group is None or labels_group is None:
         logging.warning("Warning: Nodes or labels group not found, skipping text wrapping")
         return 0
     
     # 创建节点ID到节点信息的映射
-    node_map = {}
+    # iter()是C实现的深度优先遍历，不像findall那样先物化中间列表
+    def build_node_map():
+        m = {}
+        max_d = 0
+        for circle in nodes_group.iter(SVG_CIRCLE_TAG):
+            cls = circle.get('class', '')
+            d = float(circle.get('r', '0')) * 2  # 直径 = 半径 × 2
+            m[cls] = d
+            max_d = max(max_d, d)
+        return m, max_d
+
+    # auto_font_size需要提前知道最大节点直径；
+    # 否则推迟到第一个有内容的标签出现时再遍历circle，
+    # 标签组为空时整个circle遍历都可以省掉
+    node_map = None
     max_node_diameter = 0
-    for circle in nodes_group.findall(f'.//{{{svg_ns}}}circle'):
-        node_class = circle.get('class', '')
-        node_r = float(circle.get('r', '0'))
-        node_diameter = node_r * 2  # 直径 = 半径 × 2
-        node_map[node_class] = node_diameter
-        max_node_diameter = max(max_node_diameter, node_diameter)
+    if auto_font_size:
+        node_map, max_node_diameter = build_node_map()
+
+    # 文本标签只遍历一次，后面查找最大节点和主循环共用这个列表
+    # 同一趟顺便建class到文本元素的索引，按节点查标签变成O(1)
+    text_elems = []
+    text_by_class = {}
+    for text_elem in labels_group.iter(SVG_TEXT_TAG):
+        text_elems.append(text_elem)
+        cls = text_elem.get('class', '')
+        if cls not in text_by_class:
+            text_by_class[cls] = text_elem
     
     # 如果启用自动字体大小且指定了max_font_size，先在最大节点上计算目标字体
     actual_max_font_size = max_font_size
     if auto_font_size and max_font_size is not None and max_node_diameter > 0:
         # 第一阶段：找到最大节点对应的文本，在其上计算能达到的最大字体大小
-        max_node_class = None
+        # 遍历的是节点映射（小），标签元素靠索引直接取
         max_node_text = None
-        
-        for text_elem in labels_group.findall(f'.//{{{svg_ns}}}text'):
-            node_class = text_elem.get('class', '')
-            if node_class in node_map and abs(node_map[node_class] - max_node_diameter) < 0.01:
-                max_node_class = node_class
-                max_node_text = (text_elem.text or '').strip()
-                if max_node_text:
-                    break
+
+        for node_class, diameter in node_map.items():
+            if abs(diameter - max_node_diameter) >= 0.01:
+                continue
+            candidate = text_by_class.get(node_class)
+            if candidate is None:
+                continue
+            candidate_text = (candidate.text or '').strip()
+            if candidate_text:
+                max_node_text = candidate_text
+                break
         
         # 在最大节点上计算能达到的最优字体大小
         if max_node_text:
@@ -268,65 +432,114 @@ def adjust_node_labels_in_tree(tree, root, auto_font_size=False, min_font_size=N
                 max_font_size
             )
             actual_max_font_size = achievable_font_size
-            logging.info(f"Smart sizing strategy:")
-            logging.info(f"  Max node diameter: {max_node_diameter:.1f}px")
-            logging.info(f"  Max node text: '{max_node_text[:30]}...' (len={len(max_node_text)})")
-            logging.info(f"  Target max font size: {max_font_size:.1f}pt -> Achievable: {actual_max_font_size:.1f}pt")
-            logging.info(f"  Using {actual_max_font_size:.1f}pt as ceiling for all nodes\n")
+            logging.info("Smart sizing strategy:")
+            logging.info("  Max node diameter: %.1fpx", max_node_diameter)
+            logging.info("  Max node text: '%s...' (len=%d)", max_node_text[:30], len(max_node_text))
+            logging.info("  Target max font size: %.1fpt -> Achievable: %.1fpt", max_font_size, actual_max_font_size)
+            logging.info("  Using %.1fpt as ceiling for all nodes\n", actual_max_font_size)
     
     # 处理每个文本标签
+    # 很多标签的文本和节点直径完全相同（如重复的类别名），
+    # 按(文本, 直径, 字体, 初始字号)缓存计算结果，重复标签直接命中
+    layout_cache = {}
     modified_count = 0
-    for text_elem in labels_group.findall(f'.//{{{svg_ns}}}text'):
-        node_class = text_elem.get('class', '')
-        if node_class not in node_map:
-            continue
-        
-        # 获取文本内容和字体大小
+    # 每标签的日志在INFO被关掉时连消息参数都不构造
+    info_enabled = logging.getLogger().isEnabledFor(logging.INFO)
+
+    # 确定字体大小的范围
+    # 使用 actual_max_font_size（由最大节点确定）而不是原始的 max_font_size
+    calc_min_font_size = int(min_font_size) if min_font_size is not None else 4
+    calc_max_font_size = int(actual_max_font_size) if actual_max_font_size is not None else 100
+
+    # 自动调字号时每个标签的布局计算互相独立且是纯CPU工作：
+    # 先收集去重后的任务交给进程池并行算好填进layout_cache，
+    # 之后的主循环就只剩树的修改
+    if auto_font_size and node_map:
+        pending = {}
+        for text_elem in text_elems:
+            text_content = (text_elem.text or '').strip()
+            if not text_content:
+                continue
+            node_class = text_elem.get('class', '')
+            if node_class not in node_map:
+                continue
+            font_size = float(text_elem.get('font-size', '12'))
+            font_family = text_elem.get('font-family', 'Times New Roman')
+            node_diameter = node_map[node_class]
+            cache_key = (text_content, round(node_diameter), font_family, font_size, True)
+            if cache_key not in pending:
+                pending[cache_key] = (text_content, node_diameter, font_family, font_size,
+                                     True, calc_min_font_size, calc_max_font_size)
+        # 任务数太少时进程池的启动开销超过并行收益，
+        # 直接留给主循环串行计算（同样会走layout_cache去重）
+        if len(pending) > 500:
+            with ProcessPoolExecutor() as executor:
+                results = executor.map(compute_label_layout, pending.values(), chunksize=64)
+                layout_cache.update(zip(pending.keys(), results))
+
+    # 标签去重：记录已输出的(行内容, 字号, 字体) -> (id, x, y)，
+    # 重复的标签用<use>引用第一份，缩小输出文件
+    # stdlib的Element没有getparent()，需要时先建父元素映射
+    dedup_seen = {}
+    parent_of = {}
+    if dedup_labels:
+        parent_of = {child: parent for parent in labels_group.iter() for child in parent}
+
+    # 热循环里的局部重绑定：LOAD_FAST比每次迭代的全局/内建名查找快
+    _float = float
+    _Element = ET.Element
+    cached_layout = layout_cache.get
+
+    for text_elem in text_elems:
+        # 获取文本内容，空标签直接跳过（不触发节点索引构建）
         text_content = (text_elem.text or '').strip()
         if not text_content:
             continue
+
+        # 第一个真正需要查直径的标签出现时才构建节点索引
+        if node_map is None:
+            node_map, max_node_diameter = build_node_map()
+
+        node_class = text_elem.get('class', '')
+        if node_class not in node_map:
+            continue
         
         # 不修改大小写
         # text_content = text_content.capitalize()
         
-        font_size = float(text_elem.get('font-size', '12'))
+        font_size = _float(text_elem.get('font-size', '12'))
         font_family = text_elem.get('font-family', 'Times New Roman')
         node_diameter = node_map[node_class]
-        
+
         x = text_elem.get('x', '0')
         y = text_elem.get('y', '0')
-        
-        # 第一步：如果启用自动字体大小调整，计算最优字体大小
-        if auto_font_size:
-            # 先用原始字体大小检查是否需要换行
-            text_width = estimate_text_width(text_content, font_size, font_family)
-            if text_width > node_diameter:
-                # 需要换行
-                lines_initial = wrap_text_to_fit_diameter(text_content, font_size, node_diameter, font_family)
-            else:
-                lines_initial = [text_content]
-            
-            # 确定字体大小的范围
-            # 使用 actual_max_font_size（由最大节点确定）而不是原始的 max_font_size
-            calc_min_font_size = int(min_font_size) if min_font_size is not None else 4
-            calc_max_font_size = int(actual_max_font_size) if actual_max_font_size is not None else 100
-            
-            # 对于多行文本，考虑多行所需的高度空间
-            if len(lines_initial) > 1:
-                # 多行情况：为每一行计算最优字体大小，取最小值
-                optimal_sizes = []
-                for line in lines_initial:
-                    opt_size = calculate_optimal_font_size(line, node_diameter, font_family, calc_min_font_size, calc_max_font_size)
-                    optimal_sizes.append(opt_size)
-                optimal_font_size = min(optimal_sizes)
-            else:
-                # 单行情况：直接计算最优字体大小
-                optimal_font_size = calculate_optimal_font_size(text_content, node_diameter, font_family, calc_min_font_size, calc_max_font_size)
-            
-            if optimal_font_size != font_size:
-                text_elem.set('font-size', str(optimal_font_size))
-                font_size = optimal_font_size
-                modified_count += 1
+
+        # 第一步：计算该标签的布局（字体大小 + 换行），重复的(文本, 直径)直接用缓存
+        # 直径按1px分桶：渲染上分不出亚像素的直径差异，
+        # 分桶后聚在一起的节点尺寸能命中同一份缓存
+        cache_key = (text_content, round(node_diameter), font_family, font_size, auto_font_size)
+        cached = cached_layout(cache_key)
+        if cached is not None:
+            optimal_font_size, lines_to_use = cached
+        elif not auto_font_size and estimate_text_width(text_content, font_size) <= node_diameter:
+            # 批量"宽度 > 直径"判断的逐元素内联版：
+            # 非自动字号时放得下的标签布局就是原样一行，不进布局函数
+            optimal_font_size, lines_to_use = font_size, [text_content]
+            layout_cache[cache_key] = (optimal_font_size, lines_to_use)
+        else:
+            optimal_font_size, lines_to_use = compute_label_layout(
+                (text_content, node_diameter, font_family, font_size,
+                 auto_font_size, calc_min_font_size, calc_max_font_size))
+            layout_cache[cache_key] = (optimal_font_size, lines_to_use)
+
+        # 第二步：应用字体大小调整（树的修改不走缓存）
+        if auto_font_size and optimal_font_size != font_size:
+            # :g去掉repr级的17位小数（如16.666666666666664），
+            # 渲染精度足够且输出文件明显更小
+            text_elem.set('font-size', f'{optimal_font_size:g}')
+            font_size = optimal_font_size
+            modified_count += 1
+            if info_enabled:
                 constraint_info = ""
                 if min_font_size is not None or max_font_size is not None:
                     constraints = []
@@ -335,56 +548,382 @@ def adjust_node_labels_in_tree(tree, root, auto_font_size=False, min_font_size=N
                     if max_font_size is not None:
                         constraints.append(f"max: {max_font_size:.1f}pt")
                     constraint_info = f" ({', '.join(constraints)})"
-                logging.info(f"  Auto-adjusted font size for node '{node_class}': {text_content[:30]}... -> {optimal_font_size:.1f}pt{constraint_info}")
-        
-        # 第二步：检查最终字体大小下是否需要换行
-        text_width = estimate_text_width(text_content, font_size, font_family)
-        if text_width > node_diameter:
-            # 需要换行
-            lines_to_use = wrap_text_to_fit_diameter(text_content, font_size, node_diameter, font_family)
-        else:
-            lines_to_use = [text_content]
+                logging.info("  Auto-adjusted font size for node '%s': %s... -> %.1fpt%s",
+                             node_class, text_content[:30], optimal_font_size, constraint_info)
         
+        # 去重：之前已经输出过布局完全相同的标签时，
+        # 不再复制一份文本子树，改用<use>按相对位移引用第一份
+        if dedup_labels:
+            dedup_key = (tuple(lines_to_use), font_size, font_family)
+            ref = dedup_seen.get(dedup_key)
+            if ref is not None:
+                ref_id, ref_x, ref_y = ref
+                use_elem = _Element(SVG_USE_TAG, {
+                    'href': f'#{ref_id}',
+                    'x': _fmt(_float(x) - ref_x),
+                    'y': _fmt(_float(y) - ref_y),
+                    'class': node_class
+                })
+                parent = parent_of.get(text_elem, labels_group)
+                parent.insert(list(parent).index(text_elem), use_elem)
+                parent.remove(text_elem)
+                continue
+
         # 第三步：更新文本内容（应用首字母大写）
         if len(lines_to_use) > 1:
             # 多行情况：使用tspan元素
             # 计算行高（字体大小的1.2倍）
             line_height = font_size * 1.2
-            
+
             # 计算总高度，用于垂直居中
             total_height = (len(lines_to_use) - 1) * line_height
-            start_y = float(y) - total_height / 2
-            
+            start_y = _float(y) - total_height / 2
+
+            # 预先算好每行的y坐标并格式化一次，
+            # 循环里不再做浮点运算和str()转换
+            ys_str = [_fmt(start_y + i * line_height)
+                      for i in range(len(lines_to_use))]
+
             # 清除原始文本内容
             text_elem.text = None
-            
+
             # 为每一行创建tspan元素
-            for i, line in enumerate(lines_to_use):
-                tspan = ET.SubElement(text_elem, f'{{{svg_ns}}}tspan', {
-                    'x': x,
-                    'y': str(start_y + i * line_height),
-                    'text-anchor': 'middle',
-                    'dominant-baseline': 'central'
-                })
+            # 属性字典整个标签只建一次，循环里只改y
+            # （Element构造时会拷贝attrib，复用是安全的）
+            # 先攒成列表再extend一次挂到父元素上，
+            # 不走SubElement逐个append的路径
+            tspan_attrs = {
+                'x': x,
+                'y': '',
+                'text-anchor': 'middle',
+                'dominant-baseline': 'central'
+            }
+            children = []
+            for line, y_str in zip(lines_to_use, ys_str):
+                tspan_attrs['y'] = y_str
+                tspan = _Element(SVG_TSPAN_TAG, tspan_attrs)
                 tspan.text = line
+                tspan.tail = '\n      '
+                children.append(tspan)
+            # 手工补上换行缩进：只有新建的tspan需要排版，
+            # 不必为此对整棵树做重排
+            text_elem.text = '\n      '
+            children[-1].tail = '\n    '
+            text_elem.extend(children)
             
             if auto_font_size:
                 # 如果启用了自动字体大小，不重复计数
                 pass
             else:
                 modified_count += 1
-            logging.info(f"  Wrapped node '{node_class}': {text_content[:30]}...")
+            if info_enabled:
+                logging.info("  Wrapped node '%s': %s...", node_class, text_content[:30])
         else:
             # 单行情况：直接更新文本元素
             text_elem.text = text_content
-    
+
+        # 去重：记录第一份标签，后续重复项引用它
+        if dedup_labels:
+            elem_id = text_elem.get('id')
+            if elem_id is None:
+                elem_id = f'node-label-{len(dedup_seen)}'
+                text_elem.set('id', elem_id)
+            dedup_seen[dedup_key] = (elem_id, float(x), float(y))
+
     return modified_count
 
-def add_legend_to_svg(svg_file, layer_color_map, output_file=None, auto_font_size=False, min_font_size=None, max_font_size=None, layer_order=None):
+SVG_GROUP_TAG = f'{{{SVG_NS}}}g'
+
+def _svg_labels_need_work(svg_file):
+    """
+    流式预扫描：判断固定字号下是否有标签需要调整
+
+    用iterparse做一遍C速度的只读扫描，边走边清理，不保留完整DOM。
+    返回False表示标签主循环可以整体跳过；结构不符合预期
+    （缺组、标签组先于节点组出现等）时保守返回True，交给树路径处理。
+
+    Args:
+        svg_file: SVG文件路径
+
+    Returns:
+        bool: 是否需要走标签调整主循环
+    """
+    diameters = {}
+    saw_nodes = saw_labels = False
+    nodes_done = in_nodes = in_labels = False
+
+    for event, elem in ET.iterparse(svg_file, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == SVG_GROUP_TAG:
+                gid = elem.get('id')
+                if gid == 'nodes':
+                    saw_nodes = in_nodes = True
+                elif gid == 'node-labels':
+                    if not nodes_done:
+                        # 标签组先于节点组，直径未知，放弃预扫描
+                        return True
+                    saw_labels = in_labels = True
+            continue
+        tag = elem.tag
+        if tag == SVG_CIRCLE_TAG and in_nodes:
+            diameters[elem.get('class', '')] = float(elem.get('r', '0')) * 2
+        elif tag == SVG_TEXT_TAG and in_labels:
+            text = elem.text or ''
+            stripped = text.strip()
+            if stripped:
+                d = diameters.get(elem.get('class', ''))
+                if d is not None:
+                    # 主循环会去掉首尾空白、超宽时换行，任一会改树就需要调整
+                    if text != stripped:
+                        return True
+                    if estimate_text_width(stripped, float(elem.get('font-size', '12'))) > d:
+                        return True
+        elif tag == SVG_GROUP_TAG:
+            gid = elem.get('id')
+            if gid == 'nodes':
+                in_nodes = False
+                nodes_done = True
+            elif gid == 'node-labels':
+                in_labels = False
+            elem.clear()
+
+    # 缺组时让树路径跑一遍，保留它的警告日志
+    return not (saw_nodes and saw_labels)
+
+def resolve_output_path(svg_file, output_file=None):
+    """
+    确定输出文件路径（确保不覆盖源文件）
+
+    Args:
+        svg_file: SVG源文件路径
+        output_file: 用户指定的输出路径，None时自动生成
+
+    Returns:
+        str: 输出文件路径
+    """
+    if output_file is None:
+        base_name = os.path.splitext(svg_file)[0]
+        return f"{base_name}_with_legend.svg"
+
+    # 确保输出文件路径不等于源文件路径
+    if os.path.abspath(output_file) == os.path.abspath(svg_file):
+        base_name = os.path.splitext(svg_file)[0]
+        output_path = f"{base_name}_with_legend.svg"
+        logging.warning("Warning: Output file cannot be the same as source file, automatically renamed to: %s", output_path)
+        return output_path
+
+    return output_file
+
+def compute_cache_key(gexf_file, svg_file, auto_font_size, min_font_size, max_font_size, layer_order, dedup_labels=False):
+    """
+    计算一次运行的内容哈希，作为磁盘缓存的键
+
+    输入文件内容或任何影响输出的参数变化时，哈希都会变化
+
+    Args:
+        gexf_file: GEXF文件路径
+        svg_file: SVG文件路径
+        auto_font_size / min_font_size / max_font_size / layer_order: 影响输出的参数
+
+    Returns:
+        str: 十六进制哈希串
+    """
+    h = hashlib.sha256()
+    with open(gexf_file, 'rb') as f:
+        h.update(f.read())
+    with open(svg_file, 'rb') as f:
+        h.update(f.read())
+    h.update(repr((auto_font_size, min_font_size, max_font_size, layer_order, dedup_labels)).encode('utf-8'))
+    return h.hexdigest()
+
+def _legend_loop_items(layer_color_map, sorted_layers, layer_order):
+    """
+    确定图例项的输出顺序
+
+    用户指定的顺序优先，未指定的层按字母序补在末尾
+
+    Args:
+        layer_color_map: layer到color的映射字典
+        sorted_layers: 已按字母序排好的(layer, color)列表
+        layer_order: 用户指定的层顺序（可选）
+
+    Returns:
+        list: 按最终顺序排列的(layer, color)列表
+    """
+    if not layer_order:
+        return sorted_layers
+
+    loop_items = []
+    # 先添加用户指定的层
+    for layer in layer_order:
+        if layer in layer_color_map:
+            loop_items.append((layer, layer_color_map[layer]))
+        else:
+            logging.warning("Warning: Layer '%s' specified in order not found in GEXF data.", layer)
+
+    # 添加未指定的层（按字母顺序）
+    existing_layers = set(item[0] for item in loop_items)
+    remaining_items = [(layer, color) for layer, color in sorted_layers
+                       if layer not in existing_layers]
+    if remaining_items:
+        logging.info("Appending %d unspecified layers to the end.", len(remaining_items))
+        loop_items.extend(remaining_items)
+    return loop_items
+
+def _build_legend_xml(min_x, min_y, width, height, loop_items):
+    """
+    根据画布几何和图例项列表生成图例XML字符串
+
+    树路径和字节拼接快路径共用这一份几何计算
+
+    Args:
+        min_x / min_y / width / height: 原始viewBox几何
+        loop_items: 按最终顺序排列的(layer, color)列表
+
+    Returns:
+        tuple: (图例XML字符串, 扩展后的画布宽度)
+    """
+    # 图例参数
+    title_font_size = 30  # 标题字体大小
+    item_font_size = 22   # 项目字体大小
+    color_box_size = 28   # 颜色方块大小
+    item_spacing = 50     # 项目间距
+    padding = 15          # 内边距
+    margin = 50           # 边距
+    legend_width = 300    # 图例宽度
+
+    # 计算图例高度
+    bg_height = len(loop_items) * item_spacing + padding * 2 + title_font_size + 10
+
+    # 扩展SVG视图区域以容纳图例（在右侧增加宽度）
+    new_width = width + legend_width + margin * 2
+
+    # 计算图例位置：在原来的右侧，靠下对齐
+    legend_x = min_x + width + margin
+    legend_y = min_y + height - bg_height - margin
+    y_offset = title_font_size + 15
+
+    # 拼出所有颜色方块和文本标签（分属两个共享属性的分组），
+    # layer名需要做XML转义；各行共用的偏移量提到循环外
+    box_base_y = legend_y + y_offset - color_box_size // 2 + 15
+    label_base_y = legend_y + y_offset + item_font_size // 3 + 15
+    label_x = legend_x + color_box_size + 10
+    # 按颜色归并方块的子路径（dict保持首次出现的顺序）
+    color_ds = {}
+    for i, (layer, color) in enumerate(loop_items):
+        box_y = box_base_y + i * item_spacing
+        color_ds.setdefault(color, []).append(
+            f'M{legend_x:g} {box_y:g}h{color_box_size}v{color_box_size}h-{color_box_size}z')
+    boxes_xml = ''.join(
+        LEGEND_BOX_TMPL.format(d=''.join(ds), color=color)
+        for color, ds in color_ds.items()
+    )
+    labels_xml = ''.join(
+        LEGEND_LABEL_TMPL.format(
+            label_x=label_x,
+            label_y=label_base_y + i * item_spacing,
+            label=saxutils.escape(layer),
+        )
+        for i, (layer, color) in enumerate(loop_items)
+    )
+
+    legend_xml = LEGEND_GROUP_TMPL.format(
+        bg_x=legend_x - padding,
+        bg_y=legend_y - padding,
+        bg_w=legend_width,
+        bg_h=bg_height,
+        title_x=legend_x,
+        title_y=legend_y + title_font_size,
+        title_fs=title_font_size,
+        label_fs=item_font_size,
+        boxes=boxes_xml,
+        labels=labels_xml,
+    )
+    return legend_xml, new_width
+
+# 纯追加快路径用的根元素属性匹配（只在根标签的字节片段上做替换）
+_SVG_ROOT_TAG_RE = re.compile(rb'<svg\b[^>]*>')
+_VIEWBOX_RE = re.compile(rb'viewBox="([^"]*)"')
+# 左边界断言：避免匹配到stroke-width等以width结尾的复合属性名
+_WIDTH_RE = re.compile(rb'(?<![-\w])width="([^"]*)"')
+
+def _splice_legend_bytes(raw, loop_items):
+    """
+    字节级拼接图例：改根元素的viewBox/width，把图例插到</svg>之前
+
+    不解析、不重建、不重新序列化文档其余部分，
+    大SVG上省掉整个DOM往返；原有内容逐字节保留
+
+    Args:
+        raw: 源SVG的完整字节串
+        loop_items: 按最终顺序排列的(layer, color)列表
+
+    Returns:
+        bytes: 拼接后的完整SVG字节；结构不符合预期时返回None
+    """
+    tag_m = _SVG_ROOT_TAG_RE.search(raw)
+    end_idx = raw.rfind(b'</svg>')
+    if tag_m is None or end_idx < 0:
+        return None
+    tag = tag_m.group(0)
+
+    vb_m = _VIEWBOX_RE.search(tag)
+    if vb_m is None:
+        return None
+    parts = vb_m.group(1).split()
+    if len(parts) != 4:
+        return None
+    min_x, min_y, width, height = (float(p) for p in parts)
+
+    legend_xml, new_width = _build_legend_xml(min_x, min_y, width, height, loop_items)
+
+    # 与树路径相同的属性写法，保证两条路径的几何一致
+    new_tag = _VIEWBOX_RE.sub(
+        f'viewBox="{min_x:g} {min_y:g} {new_width:g} {height:g}"'.encode('ascii'), tag, count=1)
+    if _WIDTH_RE.search(new_tag):
+        new_tag = _WIDTH_RE.sub(f'width="{new_width:g}"'.encode('ascii'), new_tag, count=1)
+    else:
+        new_tag = new_tag[:-1] + f' width="{new_width:g}"'.encode('ascii') + b'>'
+
+    return (raw[:tag_m.start()] + new_tag + raw[tag_m.end():end_idx]
+            + legend_xml.encode('utf-8') + raw[end_idx:])
+
+def _prepare_svg_tree(svg_file, auto_font_size=False, dedup_labels=False):
+    """
+    预解析SVG：判断能否走字节拼接快路径，不能时解析出完整的树
+
+    这一步和parse_gexf互相独立，main把它丢到后台线程里
+    与GEXF解析重叠执行
+
+    Args:
+        svg_file: SVG文件路径
+        auto_font_size / dedup_labels: 影响快路径判断的参数
+
+    Returns:
+        tuple: (ElementTree, 根元素)；返回None表示快路径可用，无需建树
+    """
+    if not auto_font_size and not dedup_labels and not _svg_labels_need_work(svg_file):
+        return None
+    tree = ET.parse(svg_file)
+    return tree, tree.getroot()
+
+# 区分“调用方没传预解析结果”和“预解析结果是快路径可用（None）”
+_PREP_UNSET = object()
+
+def _write_svg_bytes(output_path, svg_bytes):
+    """把序列化好的SVG字节写盘（.svgz走gzip压缩，其余大缓冲一次写出）"""
+    if output_path.endswith('.svgz'):
+        with gzip.open(output_path, 'wb', compresslevel=6) as f:
+            f.write(svg_bytes)
+    else:
+        with open(output_path, 'wb', buffering=1 << 20) as f:
+            f.write(svg_bytes)
+
+def add_legend_to_svg(svg_file, layer_color_map, output_file=None, auto_font_size=False, min_font_size=None, max_font_size=None, layer_order=None, sorted_layers=None, dedup_labels=False, svg_prep=_PREP_UNSET):
     """
     在SVG文件的右上方添加图例，同时进行节点标签换行调整
     只保存一个文件，不修改源文件
-    
+
     Args:
         svg_file: SVG文件路径
         layer_color_map: layer到color的映射字典
@@ -393,13 +932,43 @@ def add_legend_to_svg(svg_file, layer_color_map, output_file=None, auto_font_siz
         min_font_size: 最小字体大小（字体底线）
         max_font_size: 最大字体大小（字体上限）
         layer_order: 图例层的顺序列表（可选）
+        sorted_layers: 已按字母序排好的(layer, color)列表（可选，避免重复排序）
+        dedup_labels: 是否用<use>引用去重内容完全相同的标签
+        svg_prep: _prepare_svg_tree的结果（可选，main在后台线程里提前算好）
     """
-    # SVG命名空间
-    svg_ns = 'http://www.w3.org/2000/svg'
-    
-    # 解析SVG文件
-    tree = ET.parse(svg_file)
-    root = tree.getroot()
+    # 调用方（main）已经排过一次序就直接复用
+    if sorted_layers is None:
+        sorted_layers = sorted(layer_color_map.items())
+
+    # 确定输出文件路径（确保不覆盖源文件）
+    output_path = resolve_output_path(svg_file, output_file)
+
+    # 调用方没有预解析时自己做一次（库用法）
+    if svg_prep is _PREP_UNSET:
+        svg_prep = _prepare_svg_tree(svg_file, auto_font_size, dedup_labels)
+
+    # 纯追加快路径：固定字号、不去重且流式预扫描确认所有标签都
+    # 放得下时，解析+重建+序列化的整个往返都可以省掉，
+    # 直接在字节层面把图例拼到文档末尾（其余内容逐字节保留）
+    if svg_prep is None:
+        with open(svg_file, 'rb') as f:
+            raw = f.read()
+        loop_items = _legend_loop_items(layer_color_map, sorted_layers, layer_order)
+        svg_bytes = _splice_legend_bytes(raw, loop_items)
+        if svg_bytes is not None:
+            logging.info("Checking and adjusting node label text...")
+            logging.info("All node label texts already fit within node diameter, no adjustment needed\n")
+            _write_svg_bytes(output_path, svg_bytes)
+            logging.info("Saved SVG file (with text wrapping and legend): %s", output_path)
+            return output_path, svg_bytes
+        # 根元素缺viewBox等结构问题时回退到完整树路径
+
+    # 解析SVG文件（预解析结果可用时整个函数不再重新建树）
+    if svg_prep is not None:
+        tree, root = svg_prep
+    else:
+        tree = ET.parse(svg_file)
+        root = tree.getroot()
     
     # 先进行节点标签换行和字体调整
     if auto_font_size:
@@ -409,17 +978,18 @@ def add_legend_to_svg(svg_file, layer_color_map, output_file=None, auto_font_siz
         if max_font_size is not None:
             constraints.append(f"max: {max_font_size:.1f}pt")
         if constraints:
-            logging.info(f"Auto-adjusting node label font sizes ({', '.join(constraints)}) with text wrapping...")
+            logging.info("Auto-adjusting node label font sizes (%s) with text wrapping...", ', '.join(constraints))
         else:
             logging.info("Auto-adjusting node label font sizes and checking text wrapping...")
     else:
         logging.info("Checking and adjusting node label text...")
-    modified_count = adjust_node_labels_in_tree(tree, root, auto_font_size, min_font_size, max_font_size)
+    # （能整体跳过标签调整的情况已经走了上面的字节拼接快路径）
+    modified_count = adjust_node_labels_in_tree(tree, root, auto_font_size, min_font_size, max_font_size, dedup_labels)
     if modified_count > 0:
         if auto_font_size:
-            logging.info(f"Adjusted font sizes and/or text wrapping for {modified_count} node labels\n")
+            logging.info("Adjusted font sizes and/or text wrapping for %d node labels\n", modified_count)
         else:
-            logging.info(f"Adjusted text wrapping for {modified_count} node labels\n")
+            logging.info("Adjusted text wrapping for %d node labels\n", modified_count)
     else:
         logging.info("All node label texts already fit within node diameter, no adjustment needed\n")
     
@@ -437,179 +1007,104 @@ def add_legend_to_svg(svg_file, layer_color_map, output_file=None, auto_font_siz
         min_x = -width / 2
         min_y = -height / 2
     
-    # 图例参数
-    title_font_size = 30  # 标题字体大小
-    item_font_size = 22   # 项目字体大小
-    color_box_size = 28   # 颜色方块大小
-    item_spacing = 50     # 项目间距
-    padding = 15          # 内边距
-    margin = 50           # 边距
-    legend_width = 300    # 图例宽度
-    
-    # 计算图例高度
-    bg_height = len(layer_color_map) * item_spacing + padding * 2 + title_font_size + 10
-    
-    # 扩展SVG视图区域以容纳图例（新开一个地方）
-    # 在右侧增加宽度
-    original_width = width
-    width = original_width + legend_width + margin * 2
-    
-    # 更新viewBox和width属性
-    root.set('viewBox', f"{min_x} {min_y} {width} {height}")
-    root.set('width', str(width))
-    
-    # 计算图例位置：在原来的右侧，靠下对齐
-    legend_x = min_x + original_width + margin
-    legend_y = min_y + height - bg_height - margin
-    
-    # 创建图例组（使用SVG命名空间）
-    legend_group = ET.Element(f'{{{svg_ns}}}g', {'id': 'legend', 'class': 'legend'})
-    
-    # 图例背景（白色半透明背景）
-    bg_rect = ET.SubElement(legend_group, f'{{{svg_ns}}}rect', {
-        'x': str(legend_x - padding),
-        'y': str(legend_y - padding),
-        'width': str(legend_width),
-        'height': str(bg_height),
-        'fill': 'white',
-        'fill-opacity': '0.9',
-        'stroke': 'black',
-        'stroke-width': '2'
-    })
-    
-    # 添加图例标题
-    title = ET.SubElement(legend_group, f'{{{svg_ns}}}text', {
-        'x': str(legend_x),
-        'y': str(legend_y + title_font_size),
-        'font-size': str(title_font_size),
-        'font-weight': 'bold',
-        'fill': '#000000',
-        'font-family': 'Times New Roman, serif'
-    })
-    title.text = 'Layer'
-    
-    # 为每个layer添加图例项
-    y_offset = title_font_size + 15
-    
-    # 确定图例项的顺序
-    if layer_order:
-        loop_items = []
-        # 先添加用户指定的层
-        for layer in layer_order:
-            if layer in layer_color_map:
-                loop_items.append((layer, layer_color_map[layer]))
-            else:
-                logging.warning(f"Warning: Layer '{layer}' specified in order not found in GEXF data.")
-        
-        # 添加未指定的层（按字母顺序）
-        existing_layers = set(item[0] for item in loop_items)
-        remaining_items = []
-        for layer, color in sorted(layer_color_map.items()):
-            if layer not in existing_layers:
-                remaining_items.append((layer, color))
-        
-        if remaining_items:
-            logging.info(f"Appending {len(remaining_items)} unspecified layers to the end.")
-            loop_items.extend(remaining_items)
-    else:
-        loop_items = sorted(layer_color_map.items())
+    # 生成图例XML（几何计算与字节拼接快路径共用一份实现）
+    loop_items = _legend_loop_items(layer_color_map, sorted_layers, layer_order)
+    legend_xml, new_width = _build_legend_xml(min_x, min_y, width, height, loop_items)
 
-    for i, (layer, color) in enumerate(loop_items):
-        item_y = legend_y + y_offset + i * item_spacing
-        
-        # 颜色方块（增大）
-        color_rect = ET.SubElement(legend_group, f'{{{svg_ns}}}rect', {
-            'x': str(legend_x),
-            'y': str(item_y - color_box_size // 2 +15),
-            'width': str(color_box_size),
-            'height': str(color_box_size),
-            'fill': color,
-            'stroke': '#000000',
-            'stroke-width': '1'
-        })
-        
-        # 文本标签（增大字体）
-        text = ET.SubElement(legend_group, f'{{{svg_ns}}}text', {
-            'x': str(legend_x + color_box_size + 10),
-            'y': str(item_y + item_font_size // 3 + 15),
-            'font-size': str(item_font_size),
-            'fill': '#000000',
-            'font-family': 'Times New Roman, serif'
-        })
-        text.text = layer
-    
-    # 将图例添加到SVG根元素
+    # 更新viewBox和width属性（在右侧扩出放图例的区域）
+    root.set('viewBox', f"{min_x:g} {min_y:g} {new_width:g} {height:g}")
+    root.set('width', f'{new_width:g}')
+
+    # 一次性解析整个图例片段并挂到SVG根元素上
+    legend_group = ET.fromstring(legend_xml)
     root.append(legend_group)
-    
-    # 确定输出文件路径（确保不覆盖源文件）
-    if output_file is None:
-        base_name = os.path.splitext(svg_file)[0]
-        output_path = f"{base_name}_with_legend.svg"
+
+    # 只序列化一次，得到的字节串既写文件也供后续PNG转换直接使用
+    # 只有新建的图例子树需要缩进（lxml>=4.5和stdlib 3.9+都有C实现的indent），
+    # 文档主体保留源文件自带的排版，不再对整棵树做O(N)的重排
+    if hasattr(ET, 'indent'):
+        ET.indent(legend_group, space='  ', level=1)
+    legend_group.tail = '\n'
+    if _USING_LXML:
+        svg_bytes = ET.tostring(tree, encoding='utf-8', xml_declaration=True)
     else:
-        output_path = output_file
-    
-    # 确保输出文件路径不等于源文件路径
-    if os.path.abspath(output_path) == os.path.abspath(svg_file):
-        base_name = os.path.splitext(svg_file)[0]
-        output_path = f"{base_name}_with_legend.svg"
-        logging.warning(f"Warning: Output file cannot be the same as source file, automatically renamed to: {output_path}")
-    
-    # 使用原始格式保存，保持DOCTYPE声明
-    ET.register_namespace('', svg_ns)
-    
-    # 美化XML输出
-    def indent(elem, level=0):
-        """美化XML输出"""
-        i = "\n" + level * "  "
-        if len(elem):
-            if not elem.text or not elem.text.strip():
-                elem.text = i + "  "
-            if not elem.tail or not elem.tail.strip():
-                elem.tail = i
-            for child in elem:
-                indent(child, level+1)
-            if not child.tail or not child.tail.strip():
-                child.tail = i
-        else:
-            if level and (not elem.tail or not elem.tail.strip()):
-                elem.tail = i
-    
-    # 美化整个文档
-    indent(root)
-    
+        svg_bytes = ET.tostring(root, encoding='utf-8', xml_declaration=True)
+
     # 保存文件（只保存一次，包含换行调整和图例）
-    tree.write(output_path, encoding='utf-8', xml_declaration=True)
-    logging.info(f"Saved SVG file (with text wrapping and legend): {output_path}")
-    
-    return output_path
+    _write_svg_bytes(output_path, svg_bytes)
+    logging.info("Saved SVG file (with text wrapping and legend): %s", output_path)
 
-def svg_to_png(svg_file, png_file=None, dpi=300):
+    return output_path, svg_bytes
+
+def svg_to_png(svg_file, png_file=None, dpi=300, svg_bytes=None):
     """
     将SVG文件转换为PNG文件
-    
+
     Args:
         svg_file: SVG文件路径
         png_file: PNG输出文件路径，如果为None则自动生成
         dpi: 输出分辨率（默认300）
+        svg_bytes: 已序列化的SVG字节串（可选，提供时跳过重新读文件）
     """
+    if png_file is None:
+        # 自动生成PNG文件名
+        base_name = os.path.splitext(svg_file)[0]
+        png_file = f"{base_name}.png"
+
+    # .svgz输入先解压成字节串，cairosvg和内容哈希都按未压缩内容处理
+    if svg_bytes is None and svg_file.endswith('.svgz'):
+        try:
+            with gzip.open(svg_file, 'rb') as f:
+                svg_bytes = f.read()
+        except OSError:
+            pass
+
+    # 光栅化是--png模式下最贵的一步：用内容哈希旁车文件记录上一次
+    # 转换的输入，SVG和dpi都没变且PNG还在时整个cairosvg调用直接跳过
+    try:
+        if svg_bytes is not None:
+            digest = hashlib.sha256(svg_bytes).hexdigest()
+        elif hasattr(hashlib, 'file_digest'):
+            # 3.11+的file_digest分块读文件，不用整个读进内存
+            with open(svg_file, 'rb') as f:
+                digest = hashlib.file_digest(f, 'sha256').hexdigest()
+        else:
+            with open(svg_file, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        digest = None
+    sidecar_path = f"{png_file}.sha256"
+    stamp = f"{digest}:{dpi}"
+    if digest is not None and os.path.exists(png_file) and os.path.exists(sidecar_path):
+        try:
+            with open(sidecar_path, 'r', encoding='ascii') as f:
+                if f.read().strip() == stamp:
+                    logging.info("PNG up to date (content hash match), skipped conversion: %s", png_file)
+                    return True
+        except OSError:
+            pass
+
     try:
         import cairosvg
     except ImportError:
         logging.error("Error: cairosvg library is required to convert PNG")
         logging.error("Please run: uv pip install cairosvg")
         return False
-    
-    if png_file is None:
-        # 自动生成PNG文件名
-        base_name = os.path.splitext(svg_file)[0]
-        png_file = f"{base_name}.png"
-    
+
     try:
-        cairosvg.svg2png(url=svg_file, write_to=png_file, dpi=dpi)
-        logging.info(f"SVG converted to PNG: {png_file} (DPI: {dpi})")
+        # 刚生成的SVG字节还在内存里时直接喂给cairosvg，省掉一次读盘+解析
+        if svg_bytes is not None:
+            cairosvg.svg2png(bytestring=svg_bytes, write_to=png_file, dpi=dpi)
+        else:
+            cairosvg.svg2png(url=svg_file, write_to=png_file, dpi=dpi)
+        logging.info("SVG converted to PNG: %s (DPI: %d)", png_file, dpi)
+        # 记录本次转换的输入哈希，下次内容没变时直接复用PNG
+        if digest is not None:
+            with open(sidecar_path, 'w', encoding='ascii') as f:
+                f.write(stamp)
         return True
     except Exception as e:
-        logging.error(f"Error: SVG to PNG conversion failed - {e}")
+        logging.error("Error: SVG to PNG conversion failed - %s", e)
         return False
 
 def main():
@@ -631,6 +1126,7 @@ def main():
     parser.add_argument('--auto-font-size', action='store_true', help='Auto-adjust node label font sizes to fit within node diameter')
     parser.add_argument('--min-font-size', type=float, help='Minimum font size (font size floor, requires --auto-font-size)')
     parser.add_argument('--max-font-size', type=float, help='Maximum font size (font size ceiling, requires --auto-font-size, scales proportionally based on node size)')
+    parser.add_argument('--dedup-labels', action='store_true', help='Replace repeated identical node labels with SVG <use> references (smaller output)')
     
     args = parser.parse_args()
     
@@ -640,21 +1136,31 @@ def main():
     logging.info("")
     
     try:
-        # 解析GEXF文件
-        layer_color_map = parse_gexf(args.gexf_file)
-        
+        # GEXF解析和SVG预解析互相独立：SVG那边丢到后台线程，
+        # 与GEXF解析重叠执行（XML的C解析器在读文件和建树时释放GIL），
+        # 小的那个基本被完全藏进大的那个里
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            svg_future = executor.submit(_prepare_svg_tree, args.svg_file,
+                                         args.auto_font_size, args.dedup_labels)
+            # 解析GEXF文件
+            layer_color_map = parse_gexf(args.gexf_file)
+        svg_prep = svg_future.result()
+
+        # 只排一次序，日志输出、交互提示和图例绘制共用
+        sorted_layers = sorted(layer_color_map.items())
+
         # 输出结果
         logging.info("=" * 60)
         logging.info("Layer and corresponding Color:")
         logging.info("=" * 60)
         logging.info("")
-        
-        for layer, color in sorted(layer_color_map.items()):
-            logging.info(f"Layer: {layer}")
-            logging.info(f"Color: {color}")
+
+        for layer, color in sorted_layers:
+            logging.info("Layer: %s", layer)
+            logging.info("Color: %s", color)
             logging.info("-" * 60)
         
-        logging.info(f"\nFound {len(layer_color_map)} different Layers")
+        logging.info("\nFound %d different Layers", len(layer_color_map))
         logging.info("")
         
         # 交互式询问用户是否调整图例顺序
@@ -664,7 +1170,7 @@ def main():
             try:
                 print("\n" + "=" * 60)
                 print("Detected Layers:")
-                for layer in sorted(layer_color_map.keys()):
+                for layer, _ in sorted_layers:
                     print(f"  - {layer}")
                 print("=" * 60)
                 
@@ -680,26 +1186,65 @@ def main():
                 print("\nOperation cancelled by user.")
                 return
         
+        # 磁盘缓存：相同的输入文件+参数组合直接复用上一次的结果，
+        # 迭代调样式时重复运行不再重新解析/布局/序列化
+        cache_key = compute_cache_key(args.gexf_file, args.svg_file, args.auto_font_size,
+                                      args.min_font_size, args.max_font_size, layer_order,
+                                      args.dedup_labels)
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(args.svg_file)), '.legend_cache')
+        cache_path = os.path.join(cache_dir, f"{cache_key}.svg")
+        output_path = resolve_output_path(args.svg_file, args.output)
+        png_pending = bool(args.png)
+
         # 在SVG文件中添加图例并调整节点标签（只保存一个文件）
         logging.info("=" * 60)
         logging.info("Processing SVG file (text wrapping and legend addition)...")
         logging.info("=" * 60)
-        output_svg = add_legend_to_svg(args.svg_file, layer_color_map, args.output, args.auto_font_size, args.min_font_size, args.max_font_size, layer_order=layer_order)
-        
-        # 如果指定了PNG转换，则转换
-        if args.png:
+        if os.path.exists(cache_path):
+            # 缓存里存的是未压缩的SVG字节，按输出扩展名重新编码写出
+            # （.svgz走gzip），缓存条目因此与输出格式无关
+            with open(cache_path, 'rb') as f:
+                output_svg_bytes = f.read()
+            _write_svg_bytes(output_path, output_svg_bytes)
+            logging.info("Cache hit (%s...), reused cached result: %s", cache_key[:12], output_path)
+            output_svg = output_path
+        else:
+            output_svg, output_svg_bytes = add_legend_to_svg(args.svg_file, layer_color_map, output_path, args.auto_font_size, args.min_font_size, args.max_font_size, layer_order=layer_order, sorted_layers=sorted_layers, dedup_labels=args.dedup_labels, svg_prep=svg_prep)
+            if png_pending:
+                # 光栅化只依赖内存里的SVG字节串，和缓存条目的写盘互不相干：
+                # cairosvg在后台线程里先跑起来，与缓存写入重叠
+                logging.info("")
+                logging.info("=" * 60)
+                logging.info("Converting SVG to PNG...")
+                logging.info("=" * 60)
+                with ThreadPoolExecutor(max_workers=1) as png_executor:
+                    png_future = png_executor.submit(
+                        svg_to_png, output_svg, args.png_output, args.dpi, output_svg_bytes)
+                    os.makedirs(cache_dir, exist_ok=True)
+                    # 缓存始终写未压缩字节，命中时再按输出扩展名编码
+                    with open(cache_path, 'wb') as f:
+                        f.write(output_svg_bytes)
+                png_future.result()
+                png_pending = False
+            else:
+                os.makedirs(cache_dir, exist_ok=True)
+                with open(cache_path, 'wb') as f:
+                    f.write(output_svg_bytes)
+
+        # 缓存命中时复用刚读出的未压缩字节串，PNG转换不用回读输出文件
+        if png_pending:
             logging.info("")
             logging.info("=" * 60)
             logging.info("Converting SVG to PNG...")
             logging.info("=" * 60)
-            svg_to_png(output_svg, args.png_output, args.dpi)
+            svg_to_png(output_svg, args.png_output, args.dpi, svg_bytes=output_svg_bytes)
         
     except FileNotFoundError as e:
-        logging.error(f"Error: File not found - {e}")
-    except ET.ParseError as e:
-        logging.error(f"Error: XML parsing failed - {e}")
+        logging.error("Error: File not found - %s", e)
+    except _XML_PARSE_ERROR as e:
+        logging.error("Error: XML parsing failed - %s", e)
     except Exception as e:
-        logging.error(f"Error: {e}")
+        logging.error("Error: %s", e)
         import traceback
         traceback.print_exc()
 